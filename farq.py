@@ -13,7 +13,204 @@ __email__ = "mdekauwe@gmail.com"
 import sys
 import numpy as np
 import os
-import math
+
+# Kernels shared by FarquharC3, kept as plain functions of their
+# arguments so the hot path in calc_photosynthesis avoids bound-method
+# dispatch and they can be compiled/inlined independently of the class.
+
+def arrh(k25, Ea, Tk, RGAS=8.314):
+    """ Temperature dependence of kinetic parameters is described by an
+    Arrhenius function.
+
+    Parameters:
+    ----------
+    k25 : float
+        rate parameter value at 25 degC or 298 K
+    Ea : float
+        activation energy for the parameter [J mol-1]
+    Tk : float
+        leaf temperature [deg K]
+    RGAS : float
+        Universal gas constant [J mol-1 K-1]
+
+    Returns:
+    -------
+    kt : float
+        temperature dependence on parameter
+
+    References:
+    -----------
+    * Medlyn et al. 2002, PCE, 25, 1167-1179.
+    """
+    return k25 * np.exp((Ea * (Tk - 298.15)) / (298.15 * RGAS * Tk))
+
+def peaked_arrh(k25, Ea, Tk, deltaS, Hd, RGAS=8.314):
+    """ Temperature dependancy approximated by peaked Arrhenius eqn,
+    accounting for the rate of inhibition at higher temperatures.
+
+    Parameters:
+    ----------
+    k25 : float
+        rate parameter value at 25 degC or 298 K
+    Ea : float
+        activation energy for the parameter [J mol-1]
+    Tk : float
+        leaf temperature [deg K]
+    deltaS : float
+        entropy factor [J mol-1 K-1)
+    Hd : float
+        describes rate of decrease about the optimum temp [J mol-1]
+    RGAS : float
+        Universal gas constant [J mol-1 K-1]
+
+    Returns:
+    -------
+    kt : float
+        temperature dependence on parameter
+
+    References:
+    -----------
+    * Medlyn et al. 2002, PCE, 25, 1167-1179.
+
+    """
+    arg1 = arrh(k25, Ea, Tk, RGAS)
+    arg2 = 1.0 + np.exp((298.15 * deltaS - Hd) / (298.15 * RGAS))
+    arg3 = 1.0 + np.exp((Tk * deltaS - Hd) / (Tk * RGAS))
+
+    return arg1 * arg2 / arg3
+
+def assim(Ci, gamma_star, a1, a2):
+    """calculation of photosynthesis with the limitation defined by the
+    variables passed as a1 and a2, i.e. if we are calculating vcmax or
+    jmax limited assimilation rates.
+
+    Parameters:
+    ----------
+    Ci : float
+        intercellular CO2 concentration.
+    gamma_star : float
+        CO2 compensation point in the abscence of mitochondrial respiration
+    a1 : float
+        variable depends on whether the calculation is light or rubisco
+        limited.
+    a2 : float
+        variable depends on whether the calculation is light or rubisco
+        limited.
+
+    Returns:
+    -------
+    assimilation_rate : float
+        assimilation rate assuming either light or rubisco limitation.
+    """
+    return a1 * (Ci - gamma_star) / (a2 + Ci)
+
+def quadratic(a=None, b=None, c=None, large=False):
+    """ minimilist quadratic solution as root for J solution should always
+    be positive, so I have excluded other quadratic solution steps. I am
+    only returning the smallest of the two roots
+
+    Parameters:
+    ----------
+    a : float
+        co-efficient
+    b : float
+        co-efficient
+    c : float
+        co-efficient
+
+    Returns:
+    -------
+    val : float
+        positive root
+    """
+    d = b**2 - 4.0 * a * c # discriminant
+    if np.any(d < 0.0):
+        raise ValueError('imaginary root found')
+    #root1 = np.where(d>0.0, (-b - np.sqrt(d)) / (2.0 * a), d)
+    #root2 = np.where(d>0.0, (-b + np.sqrt(d)) / (2.0 * a), d)
+
+    linear = (a == 0.0) & (b > 0.0)
+    degenerate = (a == 0.0) & (b == 0.0)
+    if np.any(degenerate & (c != 0.0)):
+        raise ValueError('Cant solve quadratic')
+
+    # the linear/degenerate lanes divide by zero in the general solution,
+    # they are masked out below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if large:
+            root = (-b + np.sqrt(d)) / (2.0 * a)
+        else:
+            root = (-b - np.sqrt(d)) / (2.0 * a)
+        root = np.where(linear, -c / b, root)
+    root = np.where(degenerate, 0.0, root)
+
+    return root
+
+def leuning(Cs, vpd, g0, g1, D0, gamma, GSW_2_GSC):
+    """ Leuning (1995) stomatal model, expressed as the conductance to CO2
+    per unit assimilation
+
+    Parameters:
+    ----------
+    Cs : float
+        leaf surface CO2 concentration [umol mol-1]
+    vpd : float
+        leaf to air vapour pressure deficit [kPa]
+    g0 : float
+        residual stomatal conductance to water [mol m-2 s-1]
+    g1 : float
+        slope of the stomatal model
+    D0 : float
+        sensitivity of stomata to vpd [kPa]
+    gamma : float
+        CO2 compensation point [umol mol-1]
+    GSW_2_GSC : float
+        conversion from water to CO2 conductance
+
+    Returns:
+    -------
+    g0 : float
+        residual conductance to CO2 [mol m-2 s-1]
+    gs_over_a : float
+        conductance to CO2 per unit assimilation
+    """
+    gs_over_a = g1 / (Cs - gamma) / (1.0 + vpd / D0)
+    #ci_over_ca = 1.0 - 1.6 * (1.0 + vpd / D0) / g1
+
+    # conductance to CO2
+    return (g0 * GSW_2_GSC, gs_over_a * GSW_2_GSC)
+
+def medlyn(Cs, vpd, g1):
+    """ Medlyn et al. (2011) stomatal model, expressed as the conductance
+    to CO2 per unit assimilation
+
+    Parameters:
+    ----------
+    Cs : float
+        leaf surface CO2 concentration [umol mol-1]
+    vpd : float
+        leaf to air vapour pressure deficit [kPa]
+    g1 : float
+        slope of the stomatal model [kPa^0.5]
+
+    Returns:
+    -------
+    g0 : float
+        residual conductance to CO2 [mol m-2 s-1]
+    gs_over_a : float
+        conductance to CO2 per unit assimilation
+    """
+    # I want a zero g0, but zero messes up the convergence, numerical
+    # fix
+    g0 = 1E-09
+    vpd = np.maximum(vpd, 0.05)
+
+    # 1.6 (from corrigendum to Medlyn et al 2011) is missing here,
+    # because we are calculating conductance to CO2!
+    gs_over_a = (1.0 + g1 / np.sqrt(vpd)) / Cs
+    #ci_over_ca = g1 / (g1 + np.sqrt(vpd))
+
+    return (g0, gs_over_a)
 
 class FarquharC3(object):
     """
@@ -50,6 +247,13 @@ class FarquharC3(object):
       A review of experimental data. Plant, Cell and Enviroment 25, 1167-1179.
     """
 
+    __slots__ = ("peaked_Jmax", "peaked_Vcmax", "deg2kelvin", "RGAS", "Oi",
+                 "gamstar25", "Kc25", "Ko25", "Ec", "Eo", "Eag",
+                 "theta_hyperbol", "theta_J", "alpha", "force_vcmax_fit_pts",
+                 "change_over_pt", "model_Q10", "gs_model", "gamma", "g0",
+                 "g1", "D0", "GSC_2_GSW", "GSW_2_GSC", "_gs_fn",
+                 "_gs_args")
+
     def __init__(self, peaked_Jmax=False, peaked_Vcmax=False, Oi=210.0,
                  gamstar25=42.75, Kc25=404.9, Ko25=278.4, Ec=79430.0,
                  Eo=36380.0, Eag=37830.0, theta_hyperbol=0.9995,
@@ -139,6 +343,19 @@ class FarquharC3(object):
         self.GSC_2_GSW = 1.57
         self.GSW_2_GSC = 1.0 / self.GSC_2_GSW
 
+        # gs_model is fixed, so pick the stomatal model (and its
+        # parameters) once here rather than comparing strings on every call
+        # to calc_photosynthesis
+        if self.gs_model == "leuning":
+            self._gs_fn = leuning
+            self._gs_args = (self.g0, self.g1, self.D0, self.gamma,
+                             self.GSW_2_GSC)
+        elif self.gs_model == "medlyn":
+            self._gs_fn = medlyn
+            self._gs_args = (self.g1,)
+        else:
+            raise ValueError("Unknown gs_model: %s" % gs_model)
+
     def calc_photosynthesis(self, Cs=None, Tleaf=None, Par=None, Jmax=None,
                             Vcmax=None, Jmax25=None, Vcmax25=None, Rd=None,
                             Rd25=None, Q10=None, Eaj=None, Eav=None,
@@ -197,37 +414,26 @@ class FarquharC3(object):
         """
         self.check_supplied_args(Jmax, Vcmax, Rd, Jmax25, Vcmax25, Rd25)
 
-        # calculate temp dependancies of Michaelis–Menten constants for CO2, O2
-        Km = self.calc_michaelis_menten_constants(Tleaf)
-
-        # Effect of temp on CO2 compensation point
-        gamma_star = self.arrh(self.gamstar25, self.Eag, Tleaf)
+        (Km, gamma_star,
+         Vcmax_T, Jmax_T, Rd_T) = self._temp_params(Tleaf, Jmax25, Vcmax25,
+                                                    Rd25, Q10, Eaj, Eav,
+                                                    deltaSj, deltaSv, Hdv,
+                                                    Hdj, Ear)
 
         # Calculations at 25 degrees C or the measurement temperature
         if Rd25 is not None:
-            Rd = self.calc_resp(Tleaf, Q10, Rd25, Ear)
-
-        # Calculate temperature dependancies on Vcmax and Jmax
+            Rd = Rd_T
         if Vcmax25 is not None:
-            # Effect of temperature on Vcmax and Jamx
-            if self.peaked_Vcmax:
-                Vcmax = self.peaked_arrh(Vcmax25, Eav, Tleaf, deltaSv, Hdv)
-            else:
-                Vcmax = self.arrh(Vcmax25, Eav, Tleaf)
-
-
+            Vcmax = Vcmax_T
         if Jmax25 is not None:
-            if self.peaked_Jmax:
-                Jmax = self.peaked_arrh(Jmax25, Eaj, Tleaf, deltaSj, Hdj)
-            else:
-                Jmax = self.arrh(Jmax25, Eaj, Tleaf)
+            Jmax = Jmax_T
 
         # actual rate of electron transport, a function of absorbed PAR
         if Par is not None:
-            J = self.quadratic(a=self.theta_J,
-                               b=-(self.alpha * Par + Jmax),
-                               c=self.alpha * Par * Jmax,
-                               large=False)
+            J = quadratic(a=self.theta_J,
+                          b=-(self.alpha * Par + Jmax),
+                          c=self.alpha * Par * Jmax,
+                          large=False)
             #thetax = 0.1
             #J = ((self.alpha*Par+Jmax)-np.sqrt((self.alpha*Par+Jmax)**2-4*thetax*self.alpha*Par*Jmax))/(2*thetax)
         # all measurements are calculated under saturated light!!
@@ -237,25 +443,7 @@ class FarquharC3(object):
         Jmax = self.adj_for_low_temp(Jmax, Tleaf)
         Vcmax = self.adj_for_low_temp(Vcmax, Tleaf)
 
-        if self.gs_model == "leuning":
-            g0 = self.g0 * self.GSW_2_GSC
-            gs_over_a = self.g1 / (Cs - self.gamma) / (1.0 + vpd / self.D0)
-
-            # conductance to CO2
-            gs_over_a *= self.GSW_2_GSC
-            ci_over_ca = 1.0 - 1.6 * (1.0 + vpd / self.D0) / self.g1
-
-        elif self.gs_model == "medlyn":
-            # I want a zero g0, but zero messes up the convergence, numerical
-            # fix
-            g0 = 1E-09
-            if vpd < 0.05:
-                vpd = 0.05
-
-            # 1.6 (from corrigendum to Medlyn et al 2011) is missing here,
-            # because we are calculating conductance to CO2!
-            gs_over_a = (1.0 + self.g1 / math.sqrt(vpd)) / Cs
-            ci_over_ca = self.g1 / (self.g1 + math.sqrt(vpd))
+        (g0, gs_over_a) = self._gs_fn(Cs, vpd, *self._gs_args)
 
         # Solution when Rubisco activity is limiting
         A = g0 + gs_over_a * (Vcmax - Rd)
@@ -266,12 +454,10 @@ class FarquharC3(object):
 
 
         # intercellular CO2 concentration
-        Cic = self.quadratic(a=A, b=B, c=C, large=True)
+        Cic = quadratic(a=A, b=B, c=C, large=True)
 
-        if Cic <= 0.0 or Cic > Cs:
-            Ac = 0.0
-        else:
-            Ac = self.assim(Cic, gamma_star, a1=Vcmax, a2=Km)
+        Ac = np.where((Cic <= 0.0) | (Cic > Cs), 0.0,
+                      assim(Cic, gamma_star, a1=Vcmax, a2=Km))
 
 
         # Solution when electron transport rate is limiting
@@ -283,15 +469,16 @@ class FarquharC3(object):
                g0 * 2. * gamma_star * Cs)
 
         # intercellular CO2 concentration
-        Cij = self.quadratic(a=A, b=B, c=C, large=True)
+        Cij = quadratic(a=A, b=B, c=C, large=True)
 
         #print Cic, Cij
         #sys.exit()
-        Aj = self.assim(Cij, gamma_star, a1=Vj, a2=2.0*gamma_star)
+        Aj = assim(Cij, gamma_star, a1=Vj, a2=2.0*gamma_star)
         # Below light compensation point?
-        if Aj - Rd < 1E-6:
-            Cij = Cs
-            Aj = self.assim(Cij, gamma_star, a1=Vj, a2=2.0*gamma_star)
+        below_lcp = Aj - Rd < 1E-6
+        Cij = np.where(below_lcp, Cs, Cij)
+        Aj = np.where(below_lcp,
+                      assim(Cs, gamma_star, a1=Vj, a2=2.0*gamma_star), Aj)
 
         #print Cij/400., Cic/400., ci_over_ca
 
@@ -310,11 +497,66 @@ class FarquharC3(object):
         Acn = Ac - Rd
         Ajn = Aj - Rd
 
-        gsc = max(self.g0, self.g0 + gs_over_a * An)
+        gsc = np.fmax(self.g0, self.g0 + gs_over_a * An)
 
 
         return (An, Acn, Ajn, gsc)
 
+    def _temp_params(self, Tleaf, Jmax25, Vcmax25, Rd25, Q10, Eaj, Eav,
+                     deltaSj, deltaSv, Hdv, Hdj, Ear):
+        """ Temperature dependent parameters.
+
+        Parameters:
+        ----------
+        Tleaf : float
+            leaf temp [deg K]
+
+        Remaining parameters as for calc_photosynthesis.
+
+        Returns:
+        -------
+        Km : float
+            Michaelis-Menten constant for O2/CO2
+        gamma_star : float
+            CO2 compensation point
+        Vcmax : float
+            max rate of rubisco activity, None if Vcmax25 isn't supplied
+        Jmax : float
+            potential rate of electron transport, None if Jmax25 isn't
+            supplied
+        Rd : float
+            Day respiration, None if Rd25 isn't supplied
+        """
+        # calculate temp dependancies of Michaelis–Menten constants for CO2, O2
+        Km = self.calc_michaelis_menten_constants(Tleaf)
+
+        # Effect of temp on CO2 compensation point
+        gamma_star = arrh(self.gamstar25, self.Eag, Tleaf, self.RGAS)
+
+        Rd = None
+        if Rd25 is not None:
+            Rd = self.calc_resp(Tleaf, Q10, Rd25, Ear)
+
+        # Calculate temperature dependancies on Vcmax and Jmax
+        Vcmax = None
+        if Vcmax25 is not None:
+            # Effect of temperature on Vcmax and Jamx
+            if self.peaked_Vcmax:
+                Vcmax = peaked_arrh(Vcmax25, Eav, Tleaf, deltaSv, Hdv,
+                                    self.RGAS)
+            else:
+                Vcmax = arrh(Vcmax25, Eav, Tleaf, self.RGAS)
+
+        Jmax = None
+        if Jmax25 is not None:
+            if self.peaked_Jmax:
+                Jmax = peaked_arrh(Jmax25, Eaj, Tleaf, deltaSj, Hdj,
+                                   self.RGAS)
+            else:
+                Jmax = arrh(Jmax25, Eaj, Tleaf, self.RGAS)
+
+        return (Km, gamma_star, Vcmax, Jmax, Rd)
+
     def adj_for_low_temp(self, param, Tk, lower_bound=0.0, upper_bound=10.0):
         """
         Function allowing Jmax/Vcmax to be forced linearly to zero at low T
@@ -326,10 +568,10 @@ class FarquharC3(object):
         """
         Tc = Tk - self.deg2kelvin
 
-        if Tc < lower_bound:
-            param = 0.0
-        elif Tc < upper_bound:
-            param *= (Tc - lower_bound) / (upper_bound - lower_bound)
+        param = np.where(Tc < upper_bound,
+                         param * (Tc - lower_bound) /
+                         (upper_bound - lower_bound), param)
+        param = np.where(Tc < lower_bound, 0.0, param)
 
         return param
 
@@ -387,94 +629,24 @@ class FarquharC3(object):
         Km : float
 
         """
-        Kc = self.arrh(self.Kc25, self.Ec, Tleaf)
-        Ko = self.arrh(self.Ko25, self.Eo, Tleaf)
+        Kc = arrh(self.Kc25, self.Ec, Tleaf, self.RGAS)
+        Ko = arrh(self.Ko25, self.Eo, Tleaf, self.RGAS)
 
         Km = Kc * (1.0 + self.Oi / Ko)
 
         return Km
 
     def arrh(self, k25, Ea, Tk):
-        """ Temperature dependence of kinetic parameters is described by an
-        Arrhenius function.
-
-        Parameters:
-        ----------
-        k25 : float
-            rate parameter value at 25 degC or 298 K
-        Ea : float
-            activation energy for the parameter [J mol-1]
-        Tk : float
-            leaf temperature [deg K]
-
-        Returns:
-        -------
-        kt : float
-            temperature dependence on parameter
-
-        References:
-        -----------
-        * Medlyn et al. 2002, PCE, 25, 1167-1179.
-        """
-        return k25 * np.exp((Ea * (Tk - 298.15)) / (298.15 * self.RGAS * Tk))
+        """ See arrh (module level) """
+        return arrh(k25, Ea, Tk, self.RGAS)
 
     def peaked_arrh(self, k25, Ea, Tk, deltaS, Hd):
-        """ Temperature dependancy approximated by peaked Arrhenius eqn,
-        accounting for the rate of inhibition at higher temperatures.
-
-        Parameters:
-        ----------
-        k25 : float
-            rate parameter value at 25 degC or 298 K
-        Ea : float
-            activation energy for the parameter [J mol-1]
-        Tk : float
-            leaf temperature [deg K]
-        deltaS : float
-            entropy factor [J mol-1 K-1)
-        Hd : float
-            describes rate of decrease about the optimum temp [J mol-1]
-
-        Returns:
-        -------
-        kt : float
-            temperature dependence on parameter
-
-        References:
-        -----------
-        * Medlyn et al. 2002, PCE, 25, 1167-1179.
-
-        """
-        arg1 = self.arrh(k25, Ea, Tk)
-        arg2 = 1.0 + np.exp((298.15 * deltaS - Hd) / (298.15 * self.RGAS))
-        arg3 = 1.0 + np.exp((Tk * deltaS - Hd) / (Tk * self.RGAS))
-
-        return arg1 * arg2 / arg3
+        """ See peaked_arrh (module level) """
+        return peaked_arrh(k25, Ea, Tk, deltaS, Hd, self.RGAS)
 
     def assim(self, Ci, gamma_star, a1, a2):
-        """calculation of photosynthesis with the limitation defined by the
-        variables passed as a1 and a2, i.e. if we are calculating vcmax or
-        jmax limited assimilation rates.
-
-        Parameters:
-        ----------
-        Ci : float
-            intercellular CO2 concentration.
-        gamma_star : float
-            CO2 compensation point in the abscence of mitochondrial respiration
-        a1 : float
-            variable depends on whether the calculation is light or rubisco
-            limited.
-        a2 : float
-            variable depends on whether the calculation is light or rubisco
-            limited.
-
-        Returns:
-        -------
-        assimilation_rate : float
-            assimilation rate assuming either light or rubisco limitation.
-        """
-        return a1 * (Ci - gamma_star) / (a2 + Ci)
+        """ See assim (module level) """
+        return assim(Ci, gamma_star, a1, a2)
 
     def calc_resp(self, Tleaf=None, Q10=None, Rd25=None, Ear=None, Tref=25.0):
         """ Calculate leaf respiration accounting for temperature dependence.
@@ -503,52 +675,10 @@ class FarquharC3(object):
         if self.model_Q10:
             Rd = Rd25 * Q10**(((Tleaf - self.deg2kelvin) - Tref) / 10.0)
         else:
-            Rd = self.arrh(Rd25, Ear, Tleaf)
+            Rd = arrh(Rd25, Ear, Tleaf, self.RGAS)
 
         return Rd
 
     def quadratic(self, a=None, b=None, c=None, large=False):
-        """ minimilist quadratic solution as root for J solution should always
-        be positive, so I have excluded other quadratic solution steps. I am
-        only returning the smallest of the two roots
-
-        Parameters:
-        ----------
-        a : float
-            co-efficient
-        b : float
-            co-efficient
-        c : float
-            co-efficient
-
-        Returns:
-        -------
-        val : float
-            positive root
-        """
-        d = b**2 - 4.0 * a * c # discriminant
-        if d < 0.0:
-            raise ValueError('imaginary root found')
-        #root1 = np.where(d>0.0, (-b - np.sqrt(d)) / (2.0 * a), d)
-        #root2 = np.where(d>0.0, (-b + np.sqrt(d)) / (2.0 * a), d)
-
-        if large:
-            if a == 0.0 and b > 0.0:
-                root = -c / b
-            elif a == 0.0 and b == 0.0:
-                root = 0.0
-                if c != 0.0:
-                    raise ValueError('Cant solve quadratic')
-            else:
-                root = (-b + np.sqrt(d)) / (2.0 * a)
-        else:
-            if a == 0.0 and b > 0.0:
-                root = -c / b
-            elif a == 0.0 and b == 0.0:
-                root == 0.0
-                if c != 0.0:
-                    raise ValueError('Cant solve quadratic')
-            else:
-                root = (-b - np.sqrt(d)) / (2.0 * a)
-
-        return root
+        """ See quadratic (module level) """
+        return quadratic(a, b, c, large)
@@ -14,12 +14,19 @@ __version__ = "1.0 (23.07.2015)"
 __email__ = "mdekauwe@gmail.com"
 
 
-import math
 import sys
-from utils import calc_esat
+import numpy as np
+from utils import calc_esat, calc_esat_slope
 
 class PenmanMonteith(object):
 
+    __slots__ = ("kpa_2_pa", "sigma", "emissivity_leaf", "cp", "h2olv0",
+                 "h2omw", "air_mass", "umol_to_j", "dheat", "DEG_TO_KELVIN",
+                 "RGAS", "SW_abs", "leaf_width", "Rspecifc_dry_air",
+                 "GSC_2_GSW", "GSW_2_GSC", "GBH_2_GBW", "angle", "SW_2_PAR",
+                 "PAR_2_SW", "_sw_factor", "_cp_air_mass", "_grn_factor",
+                 "_leaf_width3")
+
     def __init__(self, leaf_width, SW_abs, angle=35.0):
 
         self.kpa_2_pa = 1000.
@@ -46,8 +53,18 @@ class PenmanMonteith(object):
         self.SW_2_PAR = 2.3
         self.PAR_2_SW = 1.0 / self.SW_2_PAR
 
+        # loop invariants, fixed once the leaf is defined
+        # absorbed short-wave radiation per unit PAR
+        self._sw_factor = self.SW_abs * self.PAR_2_SW
+        # heat capacity of air per mole (J mol-1 K-1)
+        self._cp_air_mass = self.cp * self.air_mass
+        # radiation conductance per tair_k**3
+        self._grn_factor = ((4.0 * self.sigma * self.emissivity_leaf) /
+                            self._cp_air_mass)
+        self._leaf_width3 = leaf_width * leaf_width * leaf_width
+
     def calc_et(self, tleaf, tair, vpd, pressure, wind, par, gh, gw,
-                rnet):
+                rnet, lambda_et, slope):
         """
         Calculate transpiration following Penman-Monteith at the leaf level
         accounting for effects of leaf temperature and feedback on evaporation.
@@ -76,6 +93,11 @@ class PenmanMonteith(object):
             conductance to water vapour (mol m-2 s-1)
         rnet : float
             Net radiation (J m-2 s-1 = W m-2)
+        lambda_et : float
+            latent heat of water vapour at air temperature (J mol-1)
+        slope : float
+            slope of the saturation vapour pressure curve at air temperature
+            (Pa K-1)
 
         Returns:
         --------
@@ -84,25 +106,16 @@ class PenmanMonteith(object):
         lambda_et : float
             latent heat flux (W m-2)
         """
-        # latent heat of water vapour at air temperature (j mol-1)
-        lambda_et = (self.h2olv0 - 2.365E3 * tair) * self.h2omw
-
-        # slope of sat. water vapour pressure (e_sat) to temperature curve
-        # (pa K-1), note kelvin conversion in func
-        slope = ((calc_esat(tair + 0.1, pressure) -
-                  calc_esat(tair, pressure)) / 0.1)
-        #slope = self.calc_slope_of_saturation_vapour_pressure_curve(tair)
-
         # psychrometric constant
-        gamma = self.cp * self.air_mass * pressure / lambda_et
+        gamma = self._cp_air_mass * pressure / lambda_et
 
         # Y cancels in eqn 10
-        arg1 = (slope * rnet + (vpd * self.kpa_2_pa) * gh * self.cp *
-                self.air_mass)
-        arg2 = slope + gamma * gh / gw
-
-        # W m-2
-        LE = arg1 / arg2
+        arg1 = (slope * rnet + (vpd * self.kpa_2_pa) * gh *
+                self._cp_air_mass)
+        # W m-2, no transpiration through closed stomata (gw == 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arg2 = slope + gamma * gh / gw
+            LE = np.where(gw == 0.0, 0.0, arg1 / arg2)
 
         # transpiration, mol H20 m-2 s-1
         # multiply by 18 (grams)* 0.001 (grams to kg) * 86400.
@@ -153,22 +166,19 @@ class PenmanMonteith(object):
         """
 
         # radiation conductance (mol m-2 s-1)
-        grn = ((4.0 * self.sigma * tair_k**3 * self.emissivity_leaf) /
-               (self.cp * self.air_mass))
+        grn = self._grn_factor * tair_k * tair_k * tair_k
 
         # boundary layer conductance for 1 side of leaf from forced convection
         # (mol m-2 s-1)
-        gbHw = 0.003 * math.sqrt(wind / self.leaf_width) * cmolar
+        gbHw = 0.003 * np.sqrt(wind / self.leaf_width) * cmolar
 
-        if (tleaf - tair) != 0.0:
-            # grashof number
-            grashof_num = 1.6E8 * math.fabs(tleaf - tair) * self.leaf_width**3
+        # grashof number, no free convection when tleaf == tair
+        grashof_num = 1.6E8 * np.abs(tleaf - tair) * self._leaf_width3
 
-            # boundary layer conductance for free convection
-            # (mol m-2 s-1)
-            gbHf = 0.5 * self.dheat * grashof_num**0.25 / self.leaf_width * cmolar
-        else:
-            gbHf = 0.0
+        # boundary layer conductance for free convection
+        # (mol m-2 s-1), sqrt(sqrt(x)) is cheaper than x**0.25
+        gbHf = (0.5 * self.dheat * np.sqrt(np.sqrt(grashof_num)) /
+                self.leaf_width * cmolar)
 
         # total boundary layer conductance to heat for one side of the leaf
         gbH = gbHw + gbHf
@@ -185,7 +195,7 @@ class PenmanMonteith(object):
 
         return (grn, gh, gbH, gw)
 
-    def calc_rnet(self, par, tair, tair_k, tleaf_k, vpd, pressure):
+    def calc_rnet(self, par, tair_k, vpd, esat):
         """
         Net isothermal radaiation (Rnet, W m-2), i.e. the net radiation that
         would be recieved if leaf and air temperature were the same.
@@ -198,17 +208,13 @@ class PenmanMonteith(object):
         ----------
         par : float
             Photosynthetically active radiation (umol m-2 s-1)
-        tair : float
-            air temperature (deg C)
         tair_k : float
             air temperature (K)
-        tleaf_k : float
-            leaf temperature (K)
         vpd : float
             Vapour pressure deficit (kPa, needs to be in Pa, see conversion
             below)
-        pressure : float
-            air pressure (using constant) (Pa)
+        esat : float
+            Saturation vapour pressure at air temperature (Pa)
 
         Returns:
         --------
@@ -217,14 +223,12 @@ class PenmanMonteith(object):
 
         """
 
-        # Short wave radiation (W m-2)
-        SW_rad = par * self.PAR_2_SW
-
-        # absorbed short-wave radiation
+        # absorbed short-wave radiation (W m-2)
+        SW_abs_rad = self._sw_factor * par
         #SW_abs = self.SW_abs * math.cos(math.radians(self.angle)) * SW_rad
 
         # atmospheric water vapour pressure (Pa)
-        ea = max(0.0, calc_esat(tair, pressure) - (vpd * self.kpa_2_pa))
+        ea = np.fmax(0.0, esat - (vpd * self.kpa_2_pa))
 
         # apparent emissivity for a hemisphere radiating at air temperature
         # eqn D4
@@ -232,10 +236,11 @@ class PenmanMonteith(object):
 
         # isothermal net LW radiaiton at top of canopy, assuming emissivity of
         # the canopy is 1
-        net_lw_rad = (1.0 - emissivity_atm) * self.sigma * tair_k**4
+        tair_k2 = tair_k * tair_k
+        net_lw_rad = (1.0 - emissivity_atm) * self.sigma * tair_k2 * tair_k2
 
         # isothermal net radiation (W m-2)
-        rnet = self.SW_abs * SW_rad - net_lw_rad #* kd * exp(-kd * s->lai)
+        rnet = SW_abs_rad - net_lw_rad #* kd * exp(-kd * s->lai)
 
         return rnet
 
@@ -254,25 +259,30 @@ class PenmanMonteith(object):
 
         """
         t = tair + 237.3
-        arg1 = 4098.0 * (0.6108 * math.exp((17.27 * tair) / t))
+        arg1 = 4098.0 * (0.6108 * np.exp((17.27 * tair) / t))
         arg2 = t**2
         return (arg1 / arg2) * self.kpa_2_pa
 
 
-    def main(self, tleaf, tair, gs, vpd, pressure, wind, par):
+    def main(self, tleaf, tair, gsc, vpd, pressure, wind, par):
 
-        tleaf_k = tleaf + DEG_TO_KELVIN
-        tair_k = tair + DEG_TO_KELVIN
+        tair_k = tair + self.DEG_TO_KELVIN
 
-        air_density = pressure  / (self.Rspecifc_dry_air * tair_k)
-        cmolar = pressure  / (RGAS * tair_k)
-        rnet = P.calc_rnet(par, tair, tair_k, tleaf_k, vpd, pressure)
+        # convert from mm s-1 to mol m-2 s-1
+        cmolar = pressure / (self.RGAS * tair_k)
 
-        (grn, gh, gbH, gw) = P.calc_conductances(tair_k, tleaf, tair,
-                                                 wind, gsc, cmolar)
-        (et, lambda_et) = P.calc_et(tleaf, tair, vpd, pressure, wind, par,
-                                    gh, gw, rnet)
-        return (et, lambda_et)
+        # air temperature terms, esat is shared by rnet and the slope
+        esat = calc_esat(tair, pressure)
+        lambda_et = (self.h2olv0 - 2.365E3 * tair) * self.h2omw
+        slope = calc_esat_slope(tair, esat)
+        #slope = self.calc_slope_of_saturation_vapour_pressure_curve(tair)
+
+        rnet = self.calc_rnet(par, tair_k, vpd, esat)
+        (grn, gh, gbH, gw) = self.calc_conductances(tair_k, tleaf, tair,
+                                                    wind, gsc, cmolar)
+        (et, LE) = self.calc_et(tleaf, tair, vpd, pressure, wind, par, gh, gw,
+                                rnet, lambda_et, slope)
+        return (et, LE)
 
 if __name__ == '__main__':
 
@@ -285,8 +295,6 @@ if __name__ == '__main__':
     wind = 2.0
     leaf_width = 0.02
     SW_abs = 0.5 # absorptance to short_wave rad [0,1], typically 0.4-0.6
-    DEG_TO_KELVIN = 273.15
-    RGAS = 8.314
     angle = 35.0 # angle from horizontal
 
     P = PenmanMonteith(leaf_width, SW_abs, angle)
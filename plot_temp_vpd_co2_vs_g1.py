@@ -20,7 +20,7 @@ from farq import FarquharC3
 from solve_coupled_An_gs_leaf_temp_transpiration import CoupledModel
 from utils import vpd_to_rh, get_dewpoint, calc_esat
 
-def get_values(rh, Ca, tair, par, pressure, C):
+def get_values(rh, Ca, tair, par, wind, pressure, C):
     kpa_2_pa = 1000.
     pa_2_kpa = 1.0 / kpa_2_pa
 
@@ -28,22 +28,12 @@ def get_values(rh, Ca, tair, par, pressure, C):
     ea = rh / 100. * esat
     vpd = (esat - ea) * pa_2_kpa
     #print rh, vpd
-    gs_store = []
-    et_store = []
-    An_store = []
-    tair_store = []
-    for i,ta in enumerate(tair):
-
-        #Td = get_dewpoint(ta, rh)
-        #if Td > 0.0:
-        (An, gsw, et, LE) = C.main(ta, par, vpd[i], wind, pressure, Ca)
-        gs_store.append(gsw) # mol H20 m-2 s-1
-        et_store.append(et*18*0.001*86400.) # mm d-1
-        #et_store.append(LE)
-        An_store.append(An) #umol m-2 s-1
-        #An_store.append(An*12.*0.000001*86400.) # g C m-2 d-1
-        tair_store.append(ta)
-    return gs_store, et_store, An_store, tair_store
+
+    # one call solves every tair; gs (mol H20 m-2 s-1), et (mm d-1),
+    # An (umol m-2 s-1)
+    (An, gsw, et, LE) = C.main(tair, par, vpd, wind, pressure, Ca)
+
+    return gsw, et * 18 * 0.001 * 86400., An, tair
 
 if __name__ == '__main__':
 
@@ -134,14 +124,29 @@ if __name__ == '__main__':
 
     tair = np.linspace(0.1, 40, 50)
 
+    # solve the whole (tair, rh, Ca) grid for each model in one call, then
+    # slice out each panel's curve
+    rh_vals = (90.0, 50.0, 10.0)
+    Ca_vals = (Ca1, Ca2)
+    (tair_grid, rh_grid, Ca_grid) = np.meshgrid(tair, np.array(rh_vals),
+                                                np.array(Ca_vals),
+                                                indexing="ij")
+    results = {}
+    for (gs_model, C) in (("leuning", CL), ("medlyn", CM)):
+        (gs, et, an, _) = get_values(rh_grid, Ca_grid, tair_grid, par, wind,
+                                     pressure, C)
+        for i, rh in enumerate(rh_vals):
+            for j, Ca in enumerate(Ca_vals):
+                results[(gs_model, rh, Ca)] = (gs[:,i,j], et[:,i,j],
+                                               an[:,i,j], tair)
 
 
     #
     ## LEUNING
     #
     rh = 90.
-    (gs_amb, et_amb, an_amb, tair_2plot) = get_values(rh, Ca1, tair, par, pressure, CL)
-    (gs_ele, et_ele, an_ele, tair_2plot) = get_values(rh, Ca2, tair, par, pressure, CL)
+    (gs_amb, et_amb, an_amb, tair_2plot) = results[("leuning", rh, Ca1)]
+    (gs_ele, et_ele, an_ele, tair_2plot) = results[("leuning", rh, Ca2)]
 
     ax1.plot(tair_2plot, et_amb, "r-", label="Control: %d (ppm)" % (int(Ca1)))
     ax1.plot(tair_2plot, et_ele, "r--", label="Control: %d (ppm)" % (int(Ca2)))
@@ -151,8 +156,8 @@ if __name__ == '__main__':
     ax7.plot(tair_2plot, gs_ele, "r--")
 
     rh = 50.0
-    (gs_amb, et_amb, an_amb, tair_2plot) = get_values(rh, Ca1, tair, par, pressure, CL)
-    (gs_ele, et_ele, an_ele, tair_2plot) = get_values(rh, Ca2, tair, par, pressure, CL)
+    (gs_amb, et_amb, an_amb, tair_2plot) = results[("leuning", rh, Ca1)]
+    (gs_ele, et_ele, an_ele, tair_2plot) = results[("leuning", rh, Ca2)]
 
     ax2.plot(tair_2plot, et_amb, "r-")
     ax2.plot(tair_2plot, et_ele, "r--")
@@ -162,8 +167,8 @@ if __name__ == '__main__':
     ax8.plot(tair_2plot, gs_ele, "r--")
 
     rh = 10.0
-    (gs_amb, et_amb, an_amb, tair_2plot) = get_values(rh, Ca1, tair, par, pressure, CL)
-    (gs_ele, et_ele, an_ele, tair_2plot) = get_values(rh, Ca2, tair, par, pressure, CL)
+    (gs_amb, et_amb, an_amb, tair_2plot) = results[("leuning", rh, Ca1)]
+    (gs_ele, et_ele, an_ele, tair_2plot) = results[("leuning", rh, Ca2)]
 
     ax3.plot(tair_2plot, et_amb, "r-")
     ax3.plot(tair_2plot, et_ele, "r--")
@@ -179,8 +184,8 @@ if __name__ == '__main__':
 
 
     rh = 90.0
-    (gs_amb, et_amb, an_amb, tair_2plot) = get_values(rh, Ca1, tair, par, pressure, CM)
-    (gs_ele, et_ele, an_ele, tair_2plot) = get_values(rh, Ca2, tair, par, pressure, CM)
+    (gs_amb, et_amb, an_amb, tair_2plot) = results[("medlyn", rh, Ca1)]
+    (gs_ele, et_ele, an_ele, tair_2plot) = results[("medlyn", rh, Ca2)]
 
     ax1.plot(tair_2plot, et_amb, "g-", label="Experiment: %d (ppm)" % (int(Ca1)))
     ax1.plot(tair_2plot, et_ele, "g--", label="Experiment: %d (ppm)" % (int(Ca2)))
@@ -190,8 +195,8 @@ if __name__ == '__main__':
     ax7.plot(tair_2plot, gs_ele, "g--")
 
     rh = 50.0
-    (gs_amb, et_amb, an_amb, tair_2plot) = get_values(rh, Ca1, tair, par, pressure, CM)
-    (gs_ele, et_ele, an_ele, tair_2plot) = get_values(rh, Ca2, tair, par, pressure, CM)
+    (gs_amb, et_amb, an_amb, tair_2plot) = results[("medlyn", rh, Ca1)]
+    (gs_ele, et_ele, an_ele, tair_2plot) = results[("medlyn", rh, Ca2)]
 
     ax2.plot(tair_2plot, et_amb, "g-")
     ax2.plot(tair_2plot, et_ele, "g--")
@@ -201,8 +206,8 @@ if __name__ == '__main__':
     ax8.plot(tair_2plot, gs_ele, "g--")
 
     rh = 10.0
-    (gs_amb, et_amb, an_amb, tair_2plot) = get_values(rh, Ca1, tair, par, pressure, CM)
-    (gs_ele, et_ele, an_ele, tair_2plot) = get_values(rh, Ca2, tair, par, pressure, CM)
+    (gs_amb, et_amb, an_amb, tair_2plot) = results[("medlyn", rh, Ca1)]
+    (gs_ele, et_ele, an_ele, tair_2plot) = results[("medlyn", rh, Ca2)]
 
     ax3.plot(tair_2plot, et_amb, "g-")
     ax3.plot(tair_2plot, et_ele, "g--")
@@ -14,14 +14,88 @@ __email__ = "mdekauwe@gmail.com"
 import sys
 import numpy as np
 import os
-import math
 
 from farq import FarquharC3
 from penman_monteith_leaf import PenmanMonteith
+from utils import calc_esat, calc_esat_slope
+
+def _leaf_iter_kernel(P, tleaf, tair, tair_k, gsc, vpd, pressure, wind,
+                      cmolar, rnet, lambda_et, slope):
+    """
+    Resolve leaf temp
+
+    One pass of the leaf energy balance using PenmanMonteith's
+    calc_conductances and calc_et. Terms that depend only on the air
+    (cmolar, the isothermal rnet, lambda_et, slope) are computed once per
+    solve by the caller rather than on every pass.
+
+    Parameters:
+    ----------
+    P : object
+        Penman-Montheith class instance
+    tleaf : float
+        leaf temperature (deg C)
+    tair : float
+        air temperature (deg C)
+    tair_k : float
+        air temperature (K)
+    gsc : float
+        stomatal conductance to CO2 (mol m-2 s-1)
+    vpd : float
+        Vapour pressure deficit (kPa, needs to be in Pa, see conversion
+        below)
+    pressure : float
+        air pressure (using constant) (Pa)
+    wind : float
+        wind speed (m s-1)
+    cmolar : float
+        Conversion from m s-1 to mol m-2 s-1
+    rnet : float
+        Isothermal net radiation (J m-2 s-1 = W m-2)
+    lambda_et : float
+        latent heat of water vapour at air temperature (J mol-1)
+    slope : float
+        slope of the saturation vapour pressure curve at air temperature
+        (Pa K-1)
+
+    Returns:
+    --------
+    new_Tleaf : float
+        new leaf temperature (deg C)
+    et : float
+        transpiration (mol H2O m-2 s-1)
+    le_et : float
+        latent heat flux (W m-2)
+    gbH : float
+        total boundary layer conductance to heat for one side of the leaf
+    gw : float
+        total leaf conductance to water vapour (mol m-2 s-1)
+    """
+    (grn, gh, gbH, gw) = P.calc_conductances(tair_k, tleaf, tair, wind, gsc,
+                                             cmolar)
+
+    # no transpiration through closed stomata, calc_et returns 0 there
+    (et, le_et) = P.calc_et(tleaf, tair, vpd, pressure, wind, None, gh, gw,
+                            rnet, lambda_et, slope)
+
+    # leaf-air temperature difference recalculated from energy balance.
+    delta_T = (rnet - le_et) / (P._cp_air_mass * gh)
+    new_Tleaf = tair + delta_T
+
+    return (new_Tleaf, et, le_et, gbH, gw)
 
 class CoupledModel(object):
     """Iteratively solve leaf temp, Ci, gs and An."""
 
+    __slots__ = ("g0", "g1", "D0", "gamma", "Vcmax25", "Jmax25", "Rd25",
+                 "Eaj", "Eav", "deltaSj", "deltaSv", "Hdv", "Hdj", "Q10",
+                 "leaf_width", "alpha", "SW_abs", "gs_model", "iter_max",
+                 "GBC_2_GBH", "GBH_2_GBC", "deg2kelvin", "kpa_2_pa",
+                 "pa_2_kpa", "sigma", "emissivity_leaf", "cp", "h2olv0",
+                 "h2omw", "air_mass", "umol_to_j", "dheat", "RGAS",
+                 "leaf_absorptance", "Rspecifc_dry_air", "GSC_2_GSW",
+                 "GSW_2_GSC", "F", "P")
+
     def __init__(self, g0, g1, D0, gamma, Vcmax25, Jmax25, Rd25, Eaj, Eav,
                  deltaSj, deltaSv, Hdv, Hdj, Q10, leaf_width, SW_abs,
                  gs_model, alpha=None, leaf_absorptance=0.5, iter_max=100):
@@ -70,38 +144,65 @@ class CoupledModel(object):
         self.GSC_2_GSW = 1.57
         self.GSW_2_GSC = 1.0 / self.GSC_2_GSW
 
+        # sub-models are fixed by the params, so build them once rather than
+        # on every call to main
+        self.F = FarquharC3(peaked_Jmax=True, peaked_Vcmax=True,
+                            model_Q10=True, gs_model=self.gs_model,
+                            gamma=self.gamma, g0=self.g0, g1=self.g1,
+                            D0=self.D0, alpha=self.alpha)
+        self.P = PenmanMonteith(self.leaf_width, self.leaf_absorptance)
+
     def main(self, tair, par, vpd, wind, pressure, Ca):
         """
+        All inputs may be floats or arrays (broadcast against each other),
+        every element is solved simultaneously.
+
         Parameters:
         ----------
-        tair : float
+        tair : float or array
             air temperature (deg C)
-        par : float
+        par : float or array
             Photosynthetically active radiation (umol m-2 s-1)
-        vpd : float
+        vpd : float or array
             Vapour pressure deficit (kPa, needs to be in Pa, see conversion
             below)
-        wind : float
+        wind : float or array
             wind speed (m s-1)
-        pressure : float
+        pressure : float or array
             air pressure (using constant) (Pa)
-        Ca : float
+        Ca : float or array
             ambient CO2 concentration
 
         Returns:
         --------
-        An : float
+        An : float or array
             net leaf assimilation (umol m-2 s-1)
-        gs : float
+        gs : float or array
             stomatal conductance (mol m-2 s-1)
-        et : float
+        et : float or array
             transpiration (mol H2O m-2 s-1)
+        le_et : float or array
+            latent heat flux (W m-2)
         """
 
-        F = FarquharC3(peaked_Jmax=True, peaked_Vcmax=True, model_Q10=True,
-                       gs_model=self.gs_model, gamma=self.gamma, g0=self.g0,
-                       g1=self.g1, D0=self.D0, alpha=self.alpha)
-        P = PenmanMonteith(self.leaf_width, self.leaf_absorptance)
+        F = self.F
+
+        inputs = [np.asarray(v, dtype=float)
+                  for v in (tair, par, vpd, wind, pressure, Ca)]
+        scalar = all(v.ndim == 0 for v in inputs)
+        (tair, par, vpd, wind, pressure, Ca) = np.broadcast_arrays(*inputs)
+
+        # terms that depend only on the air are fixed for the whole solve,
+        # so compute them once rather than on every pass of the kernel. esat
+        # is evaluated once and shared by the isothermal rnet and the slope.
+        P = self.P
+        tair_k = tair + self.deg2kelvin
+        cmolar = pressure / (P.RGAS * tair_k) # mm s-1 to mol m-2 s-1
+        esat = calc_esat(tair, pressure)
+        rnet = P.calc_rnet(par, tair_k, vpd, esat)
+        lambda_et = (P.h2olv0 - 2.365E3 * tair) * P.h2omw
+        slope = calc_esat_slope(tair, esat)
+        air_terms = (cmolar, rnet, lambda_et, slope)
 
         # set initialise values
         dleaf = vpd
@@ -113,11 +214,18 @@ class CoupledModel(object):
         #print "Start: %.3f %.3f %.3f" % (Cs, Tleaf, dleaf)
         #print
 
+        # elements stop updating once they have converged, so the solution
+        # matches solving each one on its own
+        converged = np.zeros(Tleaf.shape, dtype=bool)
+        An = np.zeros(Tleaf.shape)
+        gsc = np.zeros(Tleaf.shape)
+        et = np.zeros(Tleaf.shape)
+        le_et = np.zeros(Tleaf.shape)
 
         iter = 0
         while True:
-            (An, Acn,
-             Ajn, gsc) = F.calc_photosynthesis(Cs=Cs, Tleaf=Tleaf_K, Par=par,
+            (An_new, Acn,
+             Ajn, gsc_new) = F.calc_photosynthesis(Cs=Cs, Tleaf=Tleaf_K, Par=par,
                                               Jmax25=self.Jmax25,
                                               Vcmax25=self.Vcmax25,
                                               Q10=self.Q10, Eaj=self.Eaj,
@@ -130,106 +238,50 @@ class CoupledModel(object):
 
 
             # Calculate new Tleaf, dleaf, Cs
-            (new_tleaf, et, le_et, gbH, gw) = self.calc_leaf_temp(P, Tleaf, tair, gsc,
-                                                           par, vpd, pressure,
-                                                           wind)
+            (new_tleaf, et_new,
+             le_et_new, gbH, gw) = _leaf_iter_kernel(P, Tleaf, tair, tair_k,
+                                                     gsc_new, vpd, pressure,
+                                                     wind, *air_terms)
 
+            An = np.where(converged, An, An_new)
+            gsc = np.where(converged, gsc, gsc_new)
+            et = np.where(converged, et, et_new)
+            le_et = np.where(converged, le_et, le_et_new)
 
             gbc = gbH * self.GBH_2_GBC
-            Cs = Ca - An / gbc # boundary layer of leaf
-            if et == 0.0 or gw == 0.0:
-                dleaf = dair
-            else:
-                dleaf = (et * pressure / gw) * self.pa_2_kpa # kPa
+            # boundary layer of leaf, converged elements are held fixed
+            Cs = np.where(converged, Cs, Ca - An_new / gbc)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dleaf = np.where(converged, dleaf,
+                                 np.where((et_new == 0.0) | (gw == 0.0), dair,
+                                          (et_new * pressure / gw) *
+                                          self.pa_2_kpa)) # kPa
 
 
             #print "%f %f %f %f %f %f" %  (Cs, Tleaf, dleaf, An*12.*0.000001*86400., gs, et*18*0.001*86400.)
 
             # Check for convergence...?
-            if math.fabs(Tleaf - new_tleaf) < 0.02:
+            converged = converged | (np.abs(Tleaf - new_tleaf) < 0.02)
+            if np.all(converged):
                 break
 
             if iter > self.iter_max:
                 raise Exception('No convergence: %d' % (iter))
 
-            # Update temperature & do another iteration
-            Tleaf = new_tleaf
+            # Update temperature & do another iteration, converged
+            # elements are left where they are
+            Tleaf = np.where(converged, Tleaf, new_tleaf)
             Tleaf_K = Tleaf + self.deg2kelvin
 
             iter += 1
 
         gsw = gsc * self.GSC_2_GSW
 
-        return (An, gsw, et, le_et)
-
-    def calc_leaf_temp(self, P=None, tleaf=None, tair=None, gsc=None, par=None,
-                       vpd=None, pressure=None, wind=None):
-        """
-        Resolve leaf temp
+        # plain scalars in, scalars out
+        if scalar:
+            return (An[()], gsw[()], et[()], le_et[()])
 
-        Parameters:
-        ----------
-        P : object
-            Penman-Montheith class instance
-        tleaf : float
-            leaf temperature (deg C)
-        tair : float
-            air temperature (deg C)
-        gs : float
-            stomatal conductance (mol m-2 s-1)
-        par : float
-            Photosynthetically active radiation (umol m-2 s-1)
-        vpd : float
-            Vapour pressure deficit (kPa, needs to be in Pa, see conversion
-            below)
-        pressure : float
-            air pressure (using constant) (Pa)
-        wind : float
-            wind speed (m s-1)
-
-        Returns:
-        --------
-        new_Tleaf : float
-            new leaf temperature (deg C)
-        et : float
-            transpiration (mol H2O m-2 s-1)
-        gbH : float
-            total boundary layer conductance to heat for one side of the leaf
-        gw : float
-            total leaf conductance to water vapour (mol m-2 s-1)
-        """
-        tleaf_k = tleaf + self.deg2kelvin
-        tair_k = tair + self.deg2kelvin
-
-        air_density = pressure / (self.Rspecifc_dry_air * tair_k)
-
-        # convert from mm s-1 to mol m-2 s-1
-        cmolar = pressure / (self.RGAS * tair_k)
-
-        # W m-2 = J m-2 s-1
-        rnet = P.calc_rnet(par, tair, tair_k, tleaf_k, vpd, pressure)
-
-        (grn, gh, gbH, gw) = P.calc_conductances(tair_k, tleaf, tair,
-                                                 wind, gsc, cmolar)
-        if gsc == 0.0:
-            et = 0.0
-            le_et = 0.0
-        else:
-            (et, le_et) = P.calc_et(tleaf, tair, vpd, pressure, wind, par,
-                                    gh, gw, rnet)
-
-        # D6 in Leuning
-        Y = 1.0 / (1.0 + grn / gbH)
-
-        # sensible heat exchanged between leaf and surroundings
-        sensible_heat = Y * (rnet - le_et)
-
-        # leaf-air temperature difference recalculated from energy balance.
-        #delta_T = sensible_heat / (self.cp * air_density * (gh / cmolar))
-        delta_T = (rnet - le_et) / (self.cp * self.air_mass * gh)
-        new_Tleaf = tair + delta_T
-
-        return (new_Tleaf, et, le_et, gbH, gw)
+        return (An, gsw, et, le_et)
 
 if __name__ == '__main__':
 
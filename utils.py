@@ -7,22 +7,22 @@ def vpd_to_rh(vpd, tair, pressure):
 
     Parameters:
     ----------
-    tair : float
+    tair : float or array
         air temperature (deg C)
-    vpd : float
+    vpd : float or array
         Vapour pressure deficit (kPa, needs to be in Pa, see conversion
         below)
 
     Returns:
     --------
-    rh : float
+    rh : float or array
         relative humidity (fraction)
 
     """
     kpa_2_pa = 1000.
     rh = 1.0 - (vpd * kpa_2_pa) / calc_esat(tair, pressure)
 
-    return max(0.0, min(1.0, rh))
+    return np.fmax(0.0, np.fmin(1.0, rh))
 
 def calc_esat(tair, pressure):
     """
@@ -66,6 +66,29 @@ def calc_esat(tair, pressure):
 
     return esat
 
+def calc_esat_slope(tair, esat):
+    """
+    Slope of the saturation vapour pressure curve, the analytical derivative
+    of calc_esat, d/dT a * exp(b * T / (c + T)) = esat * b * c / (c + T)**2.
+    Taking esat from the caller means no extra exp.
+
+    Parameters:
+    ----------
+    tair : float
+        air temperature (deg C)
+    esat : float
+        Saturation vapour pressure at tair (Pa), from calc_esat
+
+    Returns:
+    --------
+    slope : float
+        slope of saturation vapour pressure curve (Pa K-1)
+    """
+    b = 17.502
+    c = 240.97
+
+    return esat * b * c / (c + tair)**2
+
 def get_dewpoint(tair, rh):
     """
     The air is saturated when it reaches maximum water holding capacity at a
@@ -93,6 +116,6 @@ def get_dewpoint(tair, rh):
       applications. Bull. Amer. Meteor. Soc., 86, 225-233.
       doi: http;//dx.doi.org/10.1175/BAMS-86-2-225
     """
-    Td = tair - ((100.0 - rh) / 5.)
+    Td = np.asarray(tair) - ((100.0 - np.asarray(rh)) / 5.)
 
     return Td